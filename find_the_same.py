@@ -9,35 +9,35 @@ def copy_matching_audio(folder1, folder2, output_folder):
     """
     os.makedirs(output_folder, exist_ok=True)
 
-    names_set = set()
-    for filename in os.listdir(folder1):
-        part_name = filename.split('_audio')[0]
-        names_set.add(part_name)
-
-    for filename in os.listdir(folder2):
-        part_name = filename.split('_audio')[0]
-        if part_name in names_set:
+    # scandir avoids building a full name list and caches file type;
+    # partition stops at the first '_audio' without allocating a list
+    with os.scandir(folder1) as it:
+        names_set = {entry.name.partition('_audio')[0] for entry in it if entry.is_file()}
+
+    candidates = {}
+    with os.scandir(folder2) as it:
+        for entry in it:
+            if entry.is_file():
+                candidates.setdefault(entry.name.partition('_audio')[0], []).append(entry.name)
+
+    for part_name in names_set & candidates.keys():
+        for filename in candidates[part_name]:
             src = os.path.join(folder2, filename)
             dst = os.path.join(output_folder, filename)
             shutil.copy2(src, dst)
             print(f"Copied file: {filename}")
 
 def create_mbti_csv(audio_folder, csv_path, output_csv):
-    df = pd.read_csv(csv_path)
+    df = pd.read_csv(csv_path, dtype={"username": "string"})
 
     # Extract base names from audio files and convert to lowercase
-    audio_names = set()
-    for filename in os.listdir(audio_folder):
-        part_name = filename.split('_audio')[0].lower()
-        audio_names.add(part_name)
+    with os.scandir(audio_folder) as it:
+        audio_names = frozenset(
+            entry.name.partition('_audio')[0].lower() for entry in it if entry.is_file())
 
-    # Convert the CSV column 'username' to lowercase for matching
-    df['username_lower'] = df['username'].str.lower()
-
-    matched_data = df[df['username_lower'].isin(audio_names)]
-
-    # Drop the helper column before saving
-    matched_data = matched_data.drop(columns=['username_lower'])
+    # Lowercase + isin as one boolean mask, no helper column to build and drop
+    mask = df['username'].str.lower().isin(audio_names)
+    matched_data = df.loc[mask]
 
     matched_data.to_csv(output_csv, index=False)
     print(f"Created MBTI CSV: {output_csv}")
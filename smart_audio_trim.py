@@ -1,10 +1,105 @@
 import os
 import json
+import orjson
+import hashlib
+import logging
+import functools
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from pydub import AudioSegment
-import whisper
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 import numpy as np
-from typing import Tuple, List, Optional
+from numba import njit
+from typing import Tuple, List, Optional, Dict
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 16  # number of files sent to Whisper per batch
+
+# Converted CT2 models are kept here so reruns skip the download/convert step
+MODEL_CACHE_DIR = Path.home() / ".cache" / "smart_audio_trim" / "models"
+
+def default_device_and_compute() -> Tuple[str, str]:
+    """
+    Pick the device explicitly: on GPU use int8 weights with FP16
+    activations (tensor cores), on CPU plain int8.
+    """
+    if ctranslate2.get_cuda_device_count() > 0:
+        return "cuda", "int8_float16"
+    return "cpu", "int8"
+
+@functools.lru_cache(maxsize=None)
+def load_whisper_model(model_size: str, device: str = "auto",
+                       compute_type: str = "int8") -> WhisperModel:
+    """
+    Load a Whisper model once per process and reuse it across
+    SmartAudioTrimmer instances. Weights are cached on disk under
+    MODEL_CACHE_DIR so later runs skip the download.
+    """
+    MODEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return WhisperModel(model_size, device=device, compute_type=compute_type,
+                        download_root=str(MODEL_CACHE_DIR))
+
+WHISPER_SAMPLE_RATE = 16000
+
+@functools.lru_cache(maxsize=8)
+def load_pcm(path: str, max_seconds: float) -> np.ndarray:
+    """
+    Decode up to max_seconds of a file to 16 kHz mono float32 PCM with a
+    single ffmpeg call - the exact format Whisper consumes - so
+    transcription does not spawn its own decoder per file.
+    """
+    proc = subprocess.run(
+        ["ffmpeg", "-nostdin", "-i", path, "-t", f"{max_seconds:.3f}",
+         "-ar", str(WHISPER_SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-"],
+        check=True, capture_output=True)
+    return np.frombuffer(proc.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+def probe_duration(path: str) -> float:
+    """
+    Read the container duration via ffprobe without decoding any audio.
+    """
+    proc = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", path],
+        check=True, capture_output=True, text=True)
+    return float(proc.stdout.strip())
+
+@njit(cache=True)
+def _speech_up_to(starts: np.ndarray, ends: np.ndarray, end_time: float) -> float:
+    """
+    Total speech duration before end_time. Compiled once (cached on
+    disk), then the scan runs at C speed for every file.
+    """
+    total = 0.0
+    for i in range(starts.shape[0]):
+        if starts[i] < end_time:
+            total += min(ends[i], end_time) - starts[i]
+    return total
+
+@njit(cache=True)
+def _cut_for_speech(starts: np.ndarray, ends: np.ndarray, target: float) -> float:
+    """
+    End of the first segment whose cumulative speech reaches target,
+    falling back to the last segment end.
+    """
+    cumulative = 0.0
+    for i in range(starts.shape[0]):
+        cumulative += ends[i] - starts[i]
+        if cumulative >= target:
+            return ends[i]
+    return ends[-1]
+
+@functools.lru_cache(maxsize=8)
+def load_audio(path: str) -> AudioSegment:
+    """
+    Decode an audio file once and cache it, so duration probing and
+    trimming do not demux the same file multiple times.
+    """
+    return AudioSegment.from_file(path)
 
 class SmartAudioTrimmer:
     def __init__(self, input_folder: str, output_folder: str,
@@ -24,88 +119,187 @@ class SmartAudioTrimmer:
         self.max_duration = max_duration
         self.output_folder.mkdir(parents=True, exist_ok=True)
         (self.output_folder / "logs").mkdir(exist_ok=True)
-        print(f"Loading Whisper model: {model_size}")
-        self.model = whisper.load_model(model_size)
+        self.transcript_cache_dir = self.output_folder / ".whisper_cache"
+        self.transcript_cache_dir.mkdir(exist_ok=True)
+        # One JSONL log stream for the whole run instead of a JSON file
+        # per pair; appended from trim worker threads under a lock
+        self._log_fp = open(self.output_folder / "logs" / "trim_log.jsonl", "ab")
+        self._log_lock = threading.Lock()
+        device, compute_type = default_device_and_compute()
+        log.info("Loading Whisper model: %s (%s, %s)", model_size, device, compute_type)
+        # CTranslate2 backend with int8 quantization: ~4x smaller weights,
+        # much faster than the reference PyTorch implementation
+        self.model = load_whisper_model(model_size, device, compute_type)
+        self.batched_model = BatchedInferencePipeline(model=self.model)
 
     def get_audio_duration(self, audio_path: Path) -> float:
-        audio = AudioSegment.from_file(audio_path)
+        audio = load_audio(str(audio_path))
         return len(audio) / 1000.0  # in seconds
 
+    def _transcript_cache_path(self, audio_path: Path) -> Path:
+        """
+        Cache file for a transcript, keyed by content rather than name.
+        blake2b over the first 1 MiB plus the file size is orders of
+        magnitude cheaper than transcription and changes whenever the
+        audio does. The clip limit is part of the key since it bounds
+        how much of the file was transcribed.
+        """
+        with open(audio_path, "rb") as f:
+            digest = hashlib.blake2b(f.read(1 << 20)).hexdigest()
+        key = f"{digest}_{audio_path.stat().st_size}_{self._transcribe_limit():.0f}"
+        return self.transcript_cache_dir / f"{key}.json"
+
+    def _cached_transcript(self, audio_path: Path) -> Optional[List[dict]]:
+        cache_path = self._transcript_cache_path(audio_path)
+        if cache_path.exists():
+            log.info("Using cached transcript for %s", audio_path.name)
+            with open(cache_path) as f:
+                return json.load(f)
+        return None
+
+    def _store_transcript(self, audio_path: Path, segments: List[dict]):
+        with open(self._transcript_cache_path(audio_path), "w") as f:
+            json.dump(segments, f)
+
     def transcribe(self, audio_path: Path) -> List[dict]:
         """
         Transcribe audio with Whisper, return list of segments:
         Each segment is dict with 'start', 'end', 'text'.
         """
-        print(f"Transcribing {audio_path.name}")
-        result = self.model.transcribe(str(audio_path))
-        segments = result["segments"]
+        cached = self._cached_transcript(audio_path)
+        if cached is not None:
+            return cached
+        log.info("Transcribing %s", audio_path.name)
+        pcm = load_pcm(str(audio_path), self._transcribe_limit())
+        segments_gen, info = self.model.transcribe(
+            pcm,
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=500))
+        segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segments_gen]
+        self._store_transcript(audio_path, segments)
         return segments
 
+    def _warmup(self):
+        """
+        Run one dummy transcription so lazy kernel selection and memory
+        pool allocation happen before the folder loop, not during the
+        first real file. Cost is paid once and amortizes over the run.
+        """
+        silence = np.zeros(16000, dtype=np.float32)  # 1 second at 16 kHz
+        segments_gen, info = self.model.transcribe(silence)
+        for _ in segments_gen:
+            pass
+
+    def _transcribe_limit(self) -> float:
+        # Cut points never exceed max_duration, so transcribing past it
+        # (plus a little slack for the final segment) is wasted decoding
+        return self.max_duration + 5.0
+
+    def transcribe_batch(self, audio_paths: List[Path]) -> Dict[Path, List[dict]]:
+        """
+        Transcribe a batch of audio files with the batched pipeline.
+        Returns dict mapping each path to its list of segments.
+        """
+        log.info("Transcribing batch of %d files", len(audio_paths))
+        transcriptions = {}
+        for path in audio_paths:
+            cached = self._cached_transcript(path)
+            if cached is not None:
+                transcriptions[path] = cached
+        uncached = [path for path in audio_paths if path not in transcriptions]
+
+        # Launch all ffmpeg decodes at once; the threads just overlap
+        # subprocess pipe I/O, so decoding the whole batch costs about
+        # as much as decoding its slowest file
+        pcms: Dict[Path, np.ndarray] = {}
+        if uncached:
+            with ThreadPoolExecutor(max_workers=min(len(uncached), os.cpu_count())) as pool:
+                pcms = dict(zip(uncached, pool.map(
+                    lambda p: load_pcm(str(p), self._transcribe_limit()), uncached)))
+
+        for path in uncached:
+            segments_gen, info = self.batched_model.transcribe(
+                pcms[path], batch_size=BATCH_SIZE,
+                vad_filter=True,
+                vad_parameters=dict(min_silence_duration_ms=500))
+            transcriptions[path] = [{"start": s.start, "end": s.end, "text": s.text}
+                                    for s in segments_gen]
+            self._store_transcript(path, transcriptions[path])
+        return transcriptions
+
+    @staticmethod
+    def _segment_arrays(segments: List[dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Segment dicts as (starts, ends) float64 arrays for vectorized scans.
+        """
+        n = len(segments)
+        starts = np.fromiter((s["start"] for s in segments), dtype=np.float64, count=n)
+        ends = np.fromiter((s["end"] for s in segments), dtype=np.float64, count=n)
+        return starts, ends
+
     def get_speech_duration(self, segments: List[dict], end_time: float) -> float:
         """
         Calculate total speech duration up to end_time
         """
-        total_speech = 0.0
-        for seg in segments:
-            seg_start = seg["start"]
-            seg_end = min(seg["end"], end_time)
-            if seg_start < end_time:
-                total_speech += (seg_end - seg_start)
-        return total_speech
+        if not segments:
+            return 0.0
+        starts, ends = self._segment_arrays(segments)
+        return float(_speech_up_to(starts, ends, end_time))
 
-    def find_cut_time_for_speech_duration(self, segments: List[dict], 
+    def find_cut_time_for_speech_duration(self, segments: List[dict],
                                           target_speech_duration: float) -> float:
         """
         Find the cut time needed to get approximately target_speech_duration of actual speech
         """
         if not segments:
             return self.max_duration
-        
-        cumulative_speech = 0.0
-        for seg in segments:
-            seg_duration = seg["end"] - seg["start"]
-            if cumulative_speech + seg_duration >= target_speech_duration:
-                # Cut at the end of this segment
-                return seg["end"]
-            cumulative_speech += seg_duration
-        
-        # If we haven't reached target, return last segment end
-        return segments[-1]["end"] if segments else self.max_duration
 
-    def trim_audio(self, audio_path: Path, cut_time: float) -> Path:
+        starts, ends = self._segment_arrays(segments)
+        return float(_cut_for_speech(starts, ends, target_speech_duration))
+
+    def trim_audio(self, audio_path: Path, cut_time: float,
+                   audio: Optional[AudioSegment] = None) -> Path:
         """
         Trim audio file from start to cut_time seconds.
+        Accepts an already-decoded AudioSegment to avoid demuxing again.
         Saves trimmed file in output folder preserving folder structure.
         """
-        print(f"Trimming {audio_path.name} to {cut_time:.2f} seconds")
-        audio = AudioSegment.from_file(audio_path)
-        trimmed_audio = audio[:int(cut_time * 1000)]
+        log.info("Trimming %s to %.2f seconds", audio_path.name, cut_time)
         rel_path = audio_path.relative_to(self.input_folder)
         output_path = self.output_folder / rel_path
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        trimmed_audio.export(output_path, format=audio_path.suffix[1:])
+        try:
+            # Stream copy: no decode/re-encode, just cut the container.
+            # Cut points are Whisper segment ends, so frame alignment is fine for speech.
+            subprocess.run(
+                ["ffmpeg", "-y", "-i", str(audio_path), "-t", f"{cut_time:.3f}",
+                 "-c", "copy", str(output_path)],
+                check=True, capture_output=True)
+        except subprocess.CalledProcessError:
+            # Some formats refuse mid-stream copy cuts - fall back to re-encoding
+            log.warning("Stream copy failed for %s, re-encoding", audio_path.name)
+            if audio is None:
+                audio = load_audio(str(audio_path))
+            trimmed_audio = audio[:int(cut_time * 1000)]
+            trimmed_audio.export(output_path, format=audio_path.suffix[1:])
         return output_path
 
-    def process_pair(self, original_file: Path, diarized_file: Path):
+    def process_pair(self, original_file: Path, diarized_file: Path,
+                     original_segments: List[dict], diarized_segments: List[dict]):
         """
         Process a pair of original and diarized files,
         trimming both to have approximately the same amount of actual speech.
+        Segments come precomputed from the batched transcription phase.
         """
-        print(f"Processing pair:\n  Original: {original_file.name}\n  Diarized: {diarized_file.name}")
-        
-        # Transcribe both files
-        print("Transcribing diarized file...")
-        diarized_segments = self.transcribe(diarized_file)
-        print("Transcribing original file...")
-        original_segments = self.transcribe(original_file)
-        
+        log.info("Processing pair:\n  Original: %s\n  Diarized: %s", original_file.name, diarized_file.name)
+
         # Calculate target speech duration based on diarized file
         # (assuming diarized has cleaner speech)
         diarized_speech_duration = sum(seg["end"] - seg["start"] for seg in diarized_segments)
         target_speech_duration = min(diarized_speech_duration, self.max_duration)
         target_speech_duration = max(target_speech_duration, self.min_duration)
         
-        print(f"Target speech duration: {target_speech_duration:.2f} seconds")
+        log.info("Target speech duration: %.2f seconds", target_speech_duration)
         
         # Find cut times for each file to get similar speech duration
         diarized_cut_time = self.find_cut_time_for_speech_duration(diarized_segments, target_speech_duration)
@@ -115,19 +309,23 @@ class SmartAudioTrimmer:
         diarized_cut_time = min(diarized_cut_time, self.max_duration)
         original_cut_time = min(original_cut_time, self.max_duration)
         
-        print(f"Diarized cut time: {diarized_cut_time:.2f}s")
-        print(f"Original cut time: {original_cut_time:.2f}s")
+        log.info("Diarized cut time: %.2fs", diarized_cut_time)
+        log.info("Original cut time: %.2fs", original_cut_time)
         
         # Calculate actual speech in trimmed versions
         diarized_actual_speech = self.get_speech_duration(diarized_segments, diarized_cut_time)
         original_actual_speech = self.get_speech_duration(original_segments, original_cut_time)
         
-        print(f"Diarized speech duration: {diarized_actual_speech:.2f}s")
-        print(f"Original speech duration: {original_actual_speech:.2f}s")
+        log.info("Diarized speech duration: %.2fs", diarized_actual_speech)
+        log.info("Original speech duration: %.2fs", original_actual_speech)
         
-        # Trim both files with their respective cut times
-        trimmed_original = self.trim_audio(original_file, original_cut_time)
-        trimmed_diarized = self.trim_audio(diarized_file, diarized_cut_time)
+        # Trim both files at once - each trim is an independent ffmpeg
+        # subprocess, so the pair costs as much as its slower file
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            original_future = pool.submit(self.trim_audio, original_file, original_cut_time)
+            diarized_future = pool.submit(self.trim_audio, diarized_file, diarized_cut_time)
+            trimmed_original = original_future.result()
+            trimmed_diarized = diarized_future.result()
 
         # Save logs
         log_data = {
@@ -141,57 +339,126 @@ class SmartAudioTrimmer:
             "trimmed_original": str(trimmed_original),
             "trimmed_diarized": str(trimmed_diarized),
         }
-        log_path = self.output_folder / "logs" / f"{original_file.stem}_trim_log.json"
-        with open(log_path, "w") as f:
-            json.dump(log_data, f, indent=2)
-        print(f"Saved log to {log_path}")
-        print("-" * 50)
+        self._write_log(log_data)
+        log.info("-" * 50)
 
-    def process_folder(self):
-        files = list(self.input_folder.glob("*.*"))
-        processed_stems = set()
+    def process_single(self, file: Path, segments: List[dict]):
+        """
+        Trim a file that has no pair, using precomputed segments.
+        """
+        speech_duration = sum(seg["end"] - seg["start"] for seg in segments)
+        target_speech = min(speech_duration, self.max_duration)
+        target_speech = max(target_speech, self.min_duration)
+        cut_time = self.find_cut_time_for_speech_duration(segments, target_speech)
+        cut_time = min(cut_time, self.max_duration)
+        trimmed = self.trim_audio(file, cut_time)
+        self._write_log({
+            "file": str(file),
+            "cut_time": cut_time,
+            "speech_duration": self.get_speech_duration(segments, cut_time),
+            "trimmed": str(trimmed),
+        })
+
+    def _write_log(self, log_data: dict):
+        with self._log_lock:
+            self._log_fp.write(orjson.dumps(log_data) + b"\n")
+
+    def close(self):
+        self._log_fp.close()
 
-        for file in files:
-            fname = file.name
+    def collect_work(self) -> List[Tuple[Optional[Path], Optional[Path]]]:
+        """
+        Enumerate input files into a work list of (original, diarized) tuples.
+        Either element may be None for files without a pair.
+        """
+        # One directory scan up front; pairing is then pure dict lookups
+        # with no extra exists() stat per file
+        with os.scandir(self.input_folder) as it:
+            entries = {entry.name: entry for entry in it
+                       if entry.is_file() and "." in entry.name}
+
+        processed_names = set()
+        work = []
+
+        for fname in entries:
+            file = self.input_folder / fname
             # Файл с суффиксом "_original"
             if "_original" in fname:
                 base_name = fname.replace("_original", "")
                 diarized_name = base_name + "_part1" + file.suffix  # подстройте под свой суффикс
-                diarized_path = self.input_folder / diarized_name
 
-                if diarized_path.exists():
-                    self.process_pair(file, diarized_path)
-                    processed_stems.add(fname)
-                    processed_stems.add(diarized_name)
+                if diarized_name in entries:
+                    work.append((file, self.input_folder / diarized_name))
+                    processed_names.add(fname)
+                    processed_names.add(diarized_name)
                 else:
-                    # Без пары - обрезаем только оригинал
-                    segments = self.transcribe(file)
-                    speech_duration = sum(seg["end"] - seg["start"] for seg in segments)
-                    target_speech = min(speech_duration, self.max_duration)
-                    target_speech = max(target_speech, self.min_duration)
-                    cut_time = self.find_cut_time_for_speech_duration(segments, target_speech)
-                    cut_time = min(cut_time, self.max_duration)
-                    self.trim_audio(file, cut_time)
-                    processed_stems.add(fname)
+                    # Без пары - только оригинал
+                    work.append((file, None))
+                    processed_names.add(fname)
 
             elif "_part1" in fname:
                 original_name = fname.replace("_part1", "_original")
-                original_path = self.input_folder / original_name
 
-                if not original_path.exists() and fname not in processed_stems:
-                    # Без пары - обрезаем только диаризованный файл
-                    segments = self.transcribe(file)
-                    speech_duration = sum(seg["end"] - seg["start"] for seg in segments)
-                    target_speech = min(speech_duration, self.max_duration)
-                    target_speech = max(target_speech, self.min_duration)
-                    cut_time = self.find_cut_time_for_speech_duration(segments, target_speech)
-                    cut_time = min(cut_time, self.max_duration)
-                    self.trim_audio(file, cut_time)
-                    processed_stems.add(fname)
+                if original_name not in entries and fname not in processed_names:
+                    # Без пары - только диаризованный файл
+                    work.append((None, file))
+                    processed_names.add(fname)
+
+        return work
+
+    def _submit_work_item(self, pool: ThreadPoolExecutor,
+                          original_file: Optional[Path], diarized_file: Optional[Path],
+                          transcriptions: Dict[Path, List[dict]]):
+        if original_file is not None and diarized_file is not None:
+            return pool.submit(self.process_pair, original_file, diarized_file,
+                               transcriptions[original_file],
+                               transcriptions[diarized_file])
+        elif original_file is not None:
+            return pool.submit(self.process_single, original_file,
+                               transcriptions[original_file])
+        else:
+            return pool.submit(self.process_single, diarized_file,
+                               transcriptions[diarized_file])
+
+    def process_folder(self):
+        # Phase 1: enumerate all pairs and lone files
+        work = self.collect_work()
+        if not work:
+            return
+        self._warmup()
+
+        # Bucket similar-length files into the same batch so each batch
+        # pads to its own max length, not the global one. Pairs sort by
+        # their longer file so both halves land in the same batch.
+        work.sort(key=lambda pair: max(
+            probe_duration(str(p)) for p in pair if p is not None))
+
+        # Phase 2: transcribe in batches on this thread; trimming is ffmpeg
+        # subprocess work, so hand it to a thread pool as soon as a work
+        # item has all its transcriptions, overlapping it with the next batch
+        all_paths = [p for pair in work for p in pair if p is not None]
+        transcriptions: Dict[Path, List[dict]] = {}
+        futures = []
+        next_item = 0
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            for i in range(0, len(all_paths), BATCH_SIZE):
+                transcriptions.update(self.transcribe_batch(all_paths[i:i + BATCH_SIZE]))
+                while next_item < len(work) and all(
+                        p is None or p in transcriptions for p in work[next_item]):
+                    futures.append(self._submit_work_item(pool, *work[next_item],
+                                                          transcriptions))
+                    next_item += 1
+
+            for future in as_completed(futures):
+                future.result()  # surface any trim/log errors
 
 
 
 def main():
+    # Set WARNING here to drop per-file progress messages entirely
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     INPUT_FOLDER = "/Users/margotiamanova/Desktop/PROJECTS/smart_audio_trim/input_audio_test"
     OUTPUT_FOLDER = "/Users/margotiamanova/Desktop/PROJECTS/smart_audio_trim/output_audio_test"
     MIN_DURATION = 60  # 1 minute
@@ -199,7 +466,10 @@ def main():
     MODEL_SIZE = "base"
 
     trimmer = SmartAudioTrimmer(INPUT_FOLDER, OUTPUT_FOLDER, MIN_DURATION, MAX_DURATION, MODEL_SIZE)
-    trimmer.process_folder()
+    try:
+        trimmer.process_folder()
+    finally:
+        trimmer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file